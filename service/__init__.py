@@ -25,6 +25,7 @@ import sys
 from flask import Flask
 from service import config
 from service.common import log_handlers
+from service.common.json_provider import OrjsonProvider
 
 # NOTE: Do not change the order of this code
 # The Flask app must be created
@@ -33,6 +34,10 @@ from service.common import log_handlers
 # Create the Flask aoo
 app = Flask(__name__)  # pylint: disable=invalid-name
 
+# Use orjson for all JSON encoding and decoding
+app.json_provider_class = OrjsonProvider
+app.json = OrjsonProvider(app)
+
 # Load Configurations
 app.config.from_object(config)
 
@@ -0,0 +1,56 @@
+######################################################################
+# Copyright 2016, 2023 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+JSON Provider
+
+This module contains a Flask JSON provider backed by orjson so that
+jsonify() and request.get_json() do not go through the stdlib json module
+"""
+from decimal import Decimal
+from functools import partial
+import orjson
+from flask.json.provider import JSONProvider
+
+
+def _default(obj):
+    """Serializes the types that orjson does not handle natively"""
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# orjson.dumps with the default hook bound once, returns bytes
+orjson_dumps = partial(orjson.dumps, default=_default)
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider that uses orjson for encoding and decoding"""
+
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs) -> str:
+        """Serializes obj to a JSON formatted str"""
+        return orjson_dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        """Deserializes data from a JSON formatted str or bytes"""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Builds a JSON response without decoding the encoded bytes to str"""
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson_dumps(obj), mimetype=self.mimetype)
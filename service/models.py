@@ -29,13 +29,23 @@ available (boolean) - True for products that are available for adoption
 
 """
 import logging
+import secrets
 from enum import Enum
 from decimal import Decimal
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import cast, delete, func, insert, select, update
+from sqlalchemy.orm import selectinload
 
 logger = logging.getLogger("flask.app")
 
+# Number of rows fetched from the cursor at a time when streaming results
+ROWS_PER_FETCH = 500
+
+# Bits of the random revision of a Product row, small enough that summing the
+# revisions of every row never overflows a 64-bit integer
+REVISION_BITS = 31
+
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
@@ -60,6 +70,11 @@ class Category(Enum):
     TOOLS = 5
 
 
+def _new_revision() -> int:
+    """Returns a random revision for a Product row that is written"""
+    return secrets.randbits(REVISION_BITS)
+
+
 class Product(db.Model):
     """
     Class that represents a Product
@@ -79,6 +94,10 @@ class Product(db.Model):
     category = db.Column(
         db.Enum(Category), nullable=False, server_default=(Category.UNKNOWN.name)
     )
+    # Drawn again on every INSERT and UPDATE of the row, see stamp()
+    revision = db.Column(
+        db.Integer, nullable=False, default=_new_revision, onupdate=_new_revision
+    )
 
     ##################################################
     # INSTANCE METHODS
@@ -129,18 +148,38 @@ class Product(db.Model):
         Args:
             data (dict): A dictionary containing the Product data
         """
+        for key, value in self.validate_payload(data).items():
+            setattr(self, key, value)
+        return self
+
+    ##################################################
+    # CLASS METHODS
+    ##################################################
+
+    @classmethod
+    def validate_payload(cls, data: dict) -> dict:
+        """Validates a Product dictionary without touching the database
+
+        :param data: A dictionary containing the Product data
+        :type data: dict
+
+        :return: the column values of the Product
+        :rtype: dict
+
+        """
+        values = {}
         try:
-            self.name = data["name"]
-            self.description = data["description"]
-            self.price = Decimal(data["price"])
+            values["name"] = data["name"]
+            values["description"] = data["description"]
+            values["price"] = Decimal(data["price"])
             if isinstance(data["available"], bool):
-                self.available = data["available"]
+                values["available"] = data["available"]
             else:
                 raise DataValidationError(
                     "Invalid type for boolean [available]: "
                     + str(type(data["available"]))
                 )
-            self.category = getattr(Category, data["category"])  # create enum from string
+            values["category"] = getattr(Category, data["category"])  # create enum from string
         except AttributeError as error:
             raise DataValidationError("Invalid attribute: " + error.args[0]) from error
         except KeyError as error:
@@ -149,11 +188,7 @@ class Product(db.Model):
             raise DataValidationError(
                 "Invalid product: body of request contained bad or no data " + str(error)
             ) from error
-        return self
-
-    ##################################################
-    # CLASS METHODS
-    ##################################################
+        return values
 
     @classmethod
     def init_db(cls, app: Flask):
@@ -169,11 +204,133 @@ class Product(db.Model):
         app.app_context().push()
         db.create_all()  # make our sqlalchemy tables
 
+    @classmethod
+    def _eager_select(cls):
+        """Returns the base select() statement of the finders
+
+        Relationships are loaded with selectinload so iterating the results
+        does not issue one lazy load per Product
+        """
+        return select(cls).options(selectinload("*"))
+
     @classmethod
     def all(cls) -> list:
         """Returns all of the Products in the database"""
         logger.info("Processing all Products")
-        return cls.query.all()
+        return db.session.scalars(cls._eager_select()).all()
+
+    @classmethod
+    def _row_columns(cls) -> tuple:
+        """Returns the columns selected by select_rows and the *_returning methods
+
+        The category is cast to its name by the database. The price is kept
+        as a Decimal, so it is turned into a string by str() like serialize()
+        does, whatever the database
+        """
+        return (
+            cls.id,
+            cls.name,
+            cls.description,
+            cls.price,
+            cls.available,
+            cast(cls.category, db.String).label("category"),
+        )
+
+    @classmethod
+    def create_returning(cls, values: dict):
+        """Creates a Product with a single INSERT ... RETURNING
+
+        :param values: the validated column values, see validate_payload
+        :type values: dict
+
+        :return: the created row, including the generated id
+        :rtype: Row
+
+        """
+        logger.info("Creating %s", values["name"])
+        stmt = insert(cls).values(**values).returning(*cls._row_columns())
+        row = db.session.execute(stmt).first()
+        db.session.commit()
+        return row
+
+    @classmethod
+    def update_returning(cls, product_id: int, values: dict):
+        """Updates a Product by it's ID with a single UPDATE ... RETURNING
+
+        :param product_id: the id of the Product to update
+        :type product_id: int
+        :param values: the validated column values, see validate_payload
+        :type values: dict
+
+        :return: the updated row, or None if not found
+        :rtype: Row
+
+        """
+        logger.info("Saving id %s", product_id)
+        stmt = (
+            update(cls)
+            .where(cls.id == product_id)
+            .values(**values)
+            .returning(*cls._row_columns())
+        )
+        row = db.session.execute(stmt).first()
+        db.session.commit()
+        return row
+
+    @classmethod
+    def select_rows(cls, **filters):
+        """Returns the serializable columns of the matching Products
+
+        The rows are fetched with a single column projection, so no Product
+        instances are hydrated by the ORM, and are streamed from the cursor
+        in batches of ROWS_PER_FETCH instead of being buffered all at once
+
+        :param filters: column names and the values they must be equal to
+        :type filters: dict
+
+        :return: an iterable of rows with the serialized Product columns
+        :rtype: Result
+
+        """
+        logger.info("Processing row query for %s ...", filters)
+        criteria = [getattr(cls, key) == value for key, value in filters.items()]
+        stmt = select(*cls._row_columns()).where(*criteria)
+        return db.session.execute(stmt.execution_options(yield_per=ROWS_PER_FETCH))
+
+    @classmethod
+    def stamp(cls) -> str:
+        """Returns a stamp of the Products that changes whenever any of them does
+
+        The stamp is the number of rows and the sum of their random revisions.
+        A create or a delete changes the count, an update draws a new revision,
+        whatever order concurrent transactions commit in. Writers share no row
+        to bump, so they do not wait on each other, and the random revisions
+        keep the stamp from starting over when the table is recreated
+
+        :return: the stamp of the Products
+        :rtype: str
+
+        """
+        logger.info("Processing stamp query ...")
+        # pylint: disable=not-callable
+        stmt = select(func.count(), func.coalesce(func.sum(cls.revision), 0))
+        count, total = db.session.execute(stmt).one()
+        return f"{count}-{total}"
+
+    @classmethod
+    def delete_by_id(cls, product_id: int):
+        """Removes a Product from the data store by it's ID
+
+        The row is deleted with a single DELETE statement, without looking it
+        up first, so deleting a Product that does not exist is not an error
+
+        :param product_id: the id of the Product to delete
+        :type product_id: int
+
+        """
+        logger.info("Deleting id %s", product_id)
+        db.session.execute(delete(cls).where(cls.id == product_id))
+        db.session.commit()
 
     @classmethod
     def find(cls, product_id: int):
@@ -187,7 +344,7 @@ class Product(db.Model):
 
         """
         logger.info("Processing lookup for id %s ...", product_id)
-        return cls.query.get(product_id)
+        return db.session.get(cls, product_id)
 
     @classmethod
     def find_by_name(cls, name: str) -> list:
@@ -201,7 +358,7 @@ class Product(db.Model):
 
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name)
+        return db.session.scalars(cls._eager_select().where(cls.name == name))
 
     @classmethod
     def find_by_price(cls, price: Decimal) -> list:
@@ -218,7 +375,7 @@ class Product(db.Model):
         price_value = price
         if isinstance(price, str):
             price_value = Decimal(price.strip(' "'))
-        return cls.query.filter(cls.price == price_value)
+        return db.session.scalars(cls._eager_select().where(cls.price == price_value))
 
     @classmethod
     def find_by_availability(cls, available: bool = True) -> list:
@@ -232,7 +389,7 @@ class Product(db.Model):
 
         """
         logger.info("Processing available query for %s ...", available)
-        return cls.query.filter(cls.available == available)
+        return db.session.scalars(cls._eager_select().where(cls.available == available))
 
     @classmethod
     def find_by_category(cls, category: Category = Category.UNKNOWN) -> list:
@@ -246,4 +403,4 @@ class Product(db.Model):
 
         """
         logger.info("Processing category query for %s ...", category.name)
-        return cls.query.filter(cls.category == category)
+        return db.session.scalars(cls._eager_select().where(cls.category == category))
@@ -18,12 +18,25 @@
 """
 Product Store Service with UI
 """
-from flask import jsonify, request, abort
-from flask import url_for  # noqa: F401 pylint: disable=unused-import
+import sys
+from functools import lru_cache
+from hashlib import blake2b
+import orjson
+from flask import Response, jsonify, request, abort, stream_with_context, url_for
 from service.models import Product, Category
 from service.common import status  # HTTP Status Codes
+from service.common.json_provider import orjson_dumps
 from . import app
 
+# Media type expected in the body of POST and PUT requests
+_APPLICATION_JSON = sys.intern("application/json")
+
+# Pre-encoded body of the health check, which load balancers probe constantly
+_HEALTH_BODY = orjson_dumps({"status": status.HTTP_200_OK, "message": "OK"})
+
+# Categories by name, so query values are validated with a dict lookup
+_CATEGORY_BY_NAME = {category.name: category for category in Category}
+
 
 ######################################################################
 # H E A L T H   C H E C K
@@ -31,7 +44,7 @@ from . import app
 @app.route("/health")
 def healthcheck():
     """Let them know our heart is still beating"""
-    return jsonify(status=200, message="OK"), status.HTTP_200_OK
+    return Response(_HEALTH_BODY, status=status.HTTP_200_OK, mimetype="application/json")
 
 
 ######################################################################
@@ -48,23 +61,41 @@ def index():
 ######################################################################
 def check_content_type(content_type):
     """Checks that the media type is correct"""
-    if "Content-Type" not in request.headers:
-        app.logger.error("No Content-Type specified.")
-        abort(
-            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            f"Content-Type must be {content_type}",
-        )
-
-    if request.headers["Content-Type"] == content_type:
+    request_content_type = request.content_type
+    if request_content_type == content_type:
         return
 
-    app.logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
+    if request_content_type:
+        app.logger.error("Invalid Content-Type: %s", request_content_type)
+    else:
+        app.logger.error("No Content-Type specified.")
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
         f"Content-Type must be {content_type}",
     )
 
 
+def _json_body():
+    """Decodes the JSON body of the request from bytes, without caching it"""
+    raw = request.get_data(cache=False, as_text=False)
+    data = None
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        abort(status.HTTP_400_BAD_REQUEST, "Invalid JSON")
+    return data
+
+
+@lru_cache(maxsize=16)
+def product_url_prefix(url_root: str) -> str:  # pylint: disable=unused-argument
+    """Returns the external URL of a Product without the id, for a URL root
+
+    The url_root argument is only the cache key, url_for reads it from the
+    current request
+    """
+    return url_for("get_products", product_id=0, _external=True).rpartition("/")[0] + "/"
+
+
 ######################################################################
 # C R E A T E   A   N E W   P R O D U C T
 ######################################################################
@@ -75,21 +106,18 @@ def create_products():
     This endpoint will create a Product based the data in the body that is posted
     """
     app.logger.info("Request to Create a Product...")
-    check_content_type("application/json")
+    check_content_type(_APPLICATION_JSON)
 
-    data = request.get_json()
-    app.logger.info("Processing: %s", data)
-    product = Product()
-    product.deserialize(data)
-    product.create()
-    app.logger.info("Product with new id [%s] saved!", product.id)
+    data = _json_body()
+    row = Product.create_returning(Product.validate_payload(data))
+    app.logger.info("Product with new id [%s] saved!", row.id)
 
-    message = product.serialize()
+    message = row._asdict()
 
     #
     # Uncomment this line of code once you implement READ A PRODUCT
     #
-    location_url = url_for("get_products", product_id=product.id, _external=True)
+    location_url = f"{product_url_prefix(request.url_root)}{row.id}"
     # location_url = "/"  # delete once READ is implemented
     return jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
 
@@ -97,6 +125,25 @@ def create_products():
 ######################################################################
 # L I S T   A L L   P R O D U C T S
 ######################################################################
+def _category_filter(value: str) -> dict:
+    """Builds the filter for the category query parameter"""
+    category = _CATEGORY_BY_NAME.get(value)
+    if category is None:
+        abort(
+            status.HTTP_400_BAD_REQUEST
+        )
+    return {"category": category}
+
+
+# Builders of the Product.select_rows filters by query parameter
+_FILTERS = {
+    "": lambda value: {},
+    "name": lambda value: {"name": value},
+    "category": _category_filter,
+    "available": lambda value: {"available": value.lower() == "true"},
+}
+
+
 @app.route("/products")
 def list_all_products():
     """
@@ -110,41 +157,52 @@ def list_all_products():
 
     param = ""
     value = ""
-    if len(request.args) == 1:
-        (param, value) = next(iter(request.args.items()))
-        param = param.lower()
+    if request.args:
+        key = next(iter(request.args))
+        param = key.lower()
+        value = request.args[key]
 
-    if param not in ["", "name", "category", "available"]:
+    handler = _FILTERS.get(param)
+    if handler is None:
         abort(
             status.HTTP_400_BAD_REQUEST
         )
 
-    if param == "name":
-        products = Product.find_by_name(value)
-    elif param == "category":
-        category = Category.UNKNOWN
-        try:
-            category = getattr(Category, value)
-        except AttributeError:
-            abort(
-                status.HTTP_400_BAD_REQUEST
-            )
-        products = Product.find_by_category(category)
-    elif param == "available":
-        available = value.lower() == "true"
-        products = Product.find_by_availability(available)
-    else:
-        products = Product.all()
-    serialized_products = []
-    for product in products:
-        serialized_products.append(product.serialize())
-    return jsonify(serialized_products), status.HTTP_200_OK
+    filters = handler(value)
+
+    # Any change to the products changes the stamp, and so the ETag, which
+    # also depends on the query so that every filter has ETags of its own
+    query_hash = blake2b(request.query_string, digest_size=8).hexdigest()
+    etag = f"{Product.stamp()}-{query_hash}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        response.set_etag(etag, weak=True)
+        return response
+
+    rows = Product.select_rows(**filters)
+
+    def generate():
+        """Streams the JSON array one encoded row at a time"""
+        yield b"["
+        separator = b""
+        for row in rows:
+            yield separator + orjson_dumps(row._asdict())
+            separator = b","
+        yield b"]"
+
+    response = Response(
+        stream_with_context(generate()),
+        status=status.HTTP_200_OK,
+        mimetype="application/json",
+    )
+    response.set_etag(etag, weak=True)
+    return response
 
 
 ######################################################################
 # R E A D   A   P R O D U C T
 ######################################################################
-@app.route("/products/<product_id>")
+@app.route("/products/<int:product_id>")
 def get_products(product_id):
     """
         Read a product
@@ -161,29 +219,25 @@ def get_products(product_id):
 ######################################################################
 # U P D A T E   A   P R O D U C T
 ######################################################################
-@app.route("/products/<product_id>", methods=["PUT"])
+@app.route("/products/<int:product_id>", methods=["PUT"])
 def update_products(product_id):
     """
     Updates a Product
     This endpoint will update a Product based the data in the body
     """
     app.logger.info("Request to Update a Product...")
-    check_content_type("application/json")
+    check_content_type(_APPLICATION_JSON)
 
-    data = request.get_json()
-    app.logger.info("Processing: %s", data)
+    data = _json_body()
 
-    product = Product.find(product_id)
-    if product is None:
+    row = Product.update_returning(product_id, Product.validate_payload(data))
+    if row is None:
         abort(
             status.HTTP_404_NOT_FOUND
         )
+    app.logger.info("Product with id [%s] updated!", row.id)
 
-    product.deserialize(data)
-    product.update()
-    app.logger.info("Product with id [%s] updated!", product.id)
-
-    message = product.serialize()
+    message = row._asdict()
 
     return jsonify(message), status.HTTP_200_OK
 
@@ -191,7 +245,7 @@ def update_products(product_id):
 ######################################################################
 # D E L E T E   A   P R O D U C T
 ######################################################################
-@app.route("/products/<product_id>", methods=["DELETE"])
+@app.route("/products/<int:product_id>", methods=["DELETE"])
 def delete_products(product_id):
     """
     Delete a Product
@@ -201,13 +255,7 @@ def delete_products(product_id):
 
     app.logger.info("Processing: %s", product_id)
 
-    product = Product.find(product_id)
-    if product is None:
-        abort(
-            status.HTTP_404_NOT_FOUND
-        )
-
-    product.delete()
-    app.logger.info("Product with id [%s] deleted!", product.id)
+    Product.delete_by_id(product_id)
+    app.logger.info("Product with id [%s] deleted!", product_id)
 
     return "", status.HTTP_204_NO_CONTENT